@@ -0,0 +1,40 @@
+"""add tool_calls call_uuid
+
+Revision ID: 20631b19bf3f
+Revises: a7752a14d1b9
+Create Date: 2026-10-15 01:39:46.168007
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20631b19bf3f'
+down_revision: Union[str, Sequence[str], None] = 'a7752a14d1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    insp = sa.inspect(op.get_bind())
+    # Fresh database: create_all() at app startup builds tool_calls with the column and index.
+    if not insp.has_table("tool_calls"):
+        return
+    # The table may have been created fresh (by create_all) with the column already present
+    columns = {c["name"] for c in insp.get_columns("tool_calls")}
+    if "call_uuid" not in columns:
+        op.add_column("tool_calls", sa.Column("call_uuid", sa.String(length=36), nullable=True))
+    op.create_index("ix_tool_calls_call_uuid", "tool_calls", ["call_uuid"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("tool_calls"):
+        return
+    op.drop_index("ix_tool_calls_call_uuid", table_name="tool_calls")
+    with op.batch_alter_table("tool_calls") as batch_op:
+        batch_op.drop_column("call_uuid")
@@ -0,0 +1,43 @@
+"""add success to agent_runs customer/started_at index
+
+Revision ID: a7752a14d1b9
+Revises: f5ab415a295b
+Create Date: 2026-10-15 01:36:14.711830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7752a14d1b9'
+down_revision: Union[str, Sequence[str], None] = 'f5ab415a295b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Fresh database: create_all() at app startup builds the table with the current index.
+    if not sa.inspect(op.get_bind()).has_table("agent_runs"):
+        return
+    op.drop_index("ix_agent_runs_customer_started", table_name="agent_runs", if_exists=True)
+    op.create_index(
+        "ix_agent_runs_customer_started",
+        "agent_runs",
+        ["customer_id", "started_at", "cost_usd", "success"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("agent_runs"):
+        return
+    op.drop_index("ix_agent_runs_customer_started", table_name="agent_runs")
+    op.create_index(
+        "ix_agent_runs_customer_started",
+        "agent_runs",
+        ["customer_id", "started_at", "cost_usd"],
+    )
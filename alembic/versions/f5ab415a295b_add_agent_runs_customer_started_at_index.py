@@ -0,0 +1,37 @@
+"""add agent_runs customer/started_at index
+
+Revision ID: f5ab415a295b
+Revises: 7e397c4ab275
+Create Date: 2026-10-15 01:34:21.132136
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5ab415a295b'
+down_revision: Union[str, Sequence[str], None] = '7e397c4ab275'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Tables come from create_all() at app startup; on a fresh database it creates the index too.
+    if not sa.inspect(op.get_bind()).has_table("agent_runs"):
+        return
+    op.create_index(
+        "ix_agent_runs_customer_started",
+        "agent_runs",
+        ["customer_id", "started_at", "cost_usd"],
+        # Base.metadata.create_all() at startup may already have created it
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_agent_runs_customer_started", table_name="agent_runs", if_exists=True)
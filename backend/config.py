@@ -25,6 +25,10 @@ class Settings(BaseSettings):
     # App
     ENV: str = Field(default="dev")
     CORS_ORIGINS: str = Field(default="*")
+    # Concurrent workers expected to share the DB engine (used to sanity-check the pool size)
+    WORKERS: int = Field(default=1, ge=1)
+    # Artificial per-run delay for the DummyPortia fallback (UI demos); 0 = return immediately
+    DUMMY_SIMULATE_LATENCY_MS: int = Field(default=0, ge=0)
 
     class Config:
         env_file = ".env"
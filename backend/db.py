@@ -1,7 +1,16 @@
+import atexit
+import calendar
 import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
 from contextlib import contextmanager
-from typing import Any, Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache, wraps
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 DB_PATH = os.environ.get("COST_TRACKER_DB", os.path.join(os.path.dirname(__file__), "costs.db"))
 
@@ -15,47 +24,270 @@ CREATE TABLE IF NOT EXISTS usage (
     output_tokens INTEGER NOT NULL DEFAULT 0,
     calls INTEGER NOT NULL DEFAULT 1,
     cost REAL NOT NULL DEFAULT 0.0,
-    created_at TIMESTAMP NOT NULL DEFAULT (datetime('now'))
+    created_at TIMESTAMP NOT NULL DEFAULT (datetime('now')),
+    tokens INTEGER NOT NULL DEFAULT 0 -- input_tokens + output_tokens, filled by INSERT_SQL
 );
+
+-- Pre-aggregated buckets maintained by insert_usage(); read by /summary, /alerts and /timeseries
+CREATE TABLE IF NOT EXISTS usage_daily (
+    bucket TEXT NOT NULL, -- 'YYYY-MM-DD'
+    provider TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0.0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, provider)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    bucket TEXT NOT NULL, -- 'YYYY-MM-DD HH:00'
+    provider TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0.0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, provider)
+) WITHOUT ROWID;
+"""
+
+# Created after init_db() has ensured usage.tokens exists on older databases.
+INDEXES = """
+-- Kept next to the covering index below: its implicit rowid key serves recent_usage()'s
+-- ORDER BY created_at DESC, id DESC without a sort.
 CREATE INDEX IF NOT EXISTS idx_usage_created_at ON usage(created_at);
-CREATE INDEX IF NOT EXISTS idx_usage_provider ON usage(provider);
+-- Covering indexes for window aggregates over raw rows: SUMs never touch the table.
+CREATE INDEX IF NOT EXISTS idx_usage_created_at_cost ON usage(created_at, cost, tokens, calls);
+CREATE INDEX IF NOT EXISTS idx_usage_provider_created_at ON usage(provider, created_at, cost, tokens, calls);
+DROP INDEX IF EXISTS idx_usage_provider;
 CREATE INDEX IF NOT EXISTS idx_usage_user_provider ON usage(user_id, provider);
 """
 
+# (table, strftime bucket format) for each rollup granularity
+ROLLUPS = {
+    "day": ("usage_daily", "%Y-%m-%d"),
+    "hour": ("usage_hourly", "%Y-%m-%d %H:00"),
+}
+
+# Folds usage rows with id in [?, ?] into a rollup table.
+ROLLUP_SQL = [
+    f"""
+    INSERT INTO {table} (bucket, provider, cost, tokens, calls)
+    SELECT strftime('{fmt}', created_at), provider, SUM(cost), SUM(tokens), SUM(calls)
+    FROM usage
+    WHERE id BETWEEN ? AND ?
+    GROUP BY 1, 2
+    ON CONFLICT(bucket, provider) DO UPDATE SET
+        cost = cost + excluded.cost,
+        tokens = tokens + excluded.tokens,
+        calls = calls + excluded.calls
+    """
+    for table, fmt in ROLLUPS.values()
+]
+
+# Fixed statement text per (granularity, provider filter) so sqlite3's per-connection
+# statement cache reuses the prepared plan; only the window and provider are bound.
+TIMESERIES_SQL = {
+    (granularity, by_provider): f"""
+    SELECT bucket,
+           COALESCE(SUM(cost),0.0) AS cost,
+           COALESCE(SUM(tokens),0) AS tokens,
+           COALESCE(SUM(calls),0) AS calls
+    FROM {table}
+    WHERE bucket >= strftime('{fmt}', 'now', ?){" AND provider = ?" if by_provider else ""}
+    GROUP BY bucket
+    ORDER BY bucket ASC
+    """
+    for granularity, (table, fmt) in ROLLUPS.items()
+    for by_provider in (False, True)
+}
+
+_DATE_ONLY = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Applied to every connection; journal_mode=WAL is persistent and set once in init_db().
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+# One long-lived connection per thread; _open_conns lets atexit (and pruning) close them.
+_local = threading.local()
+_open_conns: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+_open_conns_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    # Autocommit mode: reads run without a transaction, writes open one via write_txn().
+    conn = sqlite3.connect(
+        DB_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _open_conns_lock:
+        # Worker threads come and go; release connections whose owner has exited.
+        for owner, stale in [c for c in _open_conns if not c[0].is_alive()]:
+            stale.close()
+            _open_conns.remove((owner, stale))
+        _open_conns.append((threading.current_thread(), conn))
+    return conn
+
 
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
     try:
         yield conn
-        conn.commit()
     finally:
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
+
+
+@contextmanager
+def write_txn(conn: sqlite3.Connection):
+    # Take the reserved lock up front so concurrent writers queue on busy_timeout instead of deadlocking.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _usage_columns(conn: sqlite3.Connection) -> set:
+    return {row["name"] for row in conn.execute("PRAGMA table_info(usage)")}
 
 
 def init_db() -> None:
     with get_conn() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.executescript(SCHEMA)
+        if "tokens" not in _usage_columns(conn):
+            with write_txn(conn):
+                # Re-check under the write lock: another worker may have migrated in the meantime.
+                if "tokens" not in _usage_columns(conn):
+                    conn.execute("ALTER TABLE usage ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0")
+                    conn.execute("UPDATE usage SET tokens = input_tokens + output_tokens")
+        conn.executescript(INDEXES)
+        # Backfill rollups for databases created before they existed. The emptiness check runs
+        # under BEGIN IMMEDIATE so workers starting together don't each backfill.
+        with write_txn(conn):
+            if conn.execute("SELECT 1 FROM usage_daily LIMIT 1").fetchone() is None:
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM usage").fetchone()[0]
+                for sql in ROLLUP_SQL:
+                    conn.execute(sql, (0, max_id))
 
 
-def insert_usage(record: Dict[str, Any]) -> int:
-    with get_conn() as conn:
-        cur = conn.execute(
-            """
-            INSERT INTO usage (user_id, provider, model, input_tokens, output_tokens, calls, cost, created_at)
-            VALUES (:user_id, :provider, :model, :input_tokens, :output_tokens, :calls, :cost, COALESCE(:created_at, datetime('now')))
-            """,
-            record,
-        )
-        return cur.lastrowid
+# (user_id, provider, model, input_tokens, output_tokens, calls, cost, created_at or None)
+UsageRecord = Tuple[str, str, str, int, int, int, float, Optional[str]]
+
+# Positional parameters bind faster than named ones; ?4 + ?5 fills tokens.
+INSERT_SQL = """
+INSERT INTO usage (user_id, provider, model, input_tokens, output_tokens, tokens, calls, cost, created_at)
+VALUES (?1, ?2, ?3, ?4, ?5, ?4 + ?5, ?6, ?7, COALESCE(?8, datetime('now')))
+"""
+
+
+def insert_usage(records: Sequence[UsageRecord]) -> List[int]:
+    if not records:
+        return []
+    with get_conn() as conn, write_txn(conn):
+        conn.executemany(INSERT_SQL, records)
+        # BEGIN IMMEDIATE keeps other writers out, so the AUTOINCREMENT ids are contiguous.
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        first_id = last_id - len(records) + 1
+        for sql in ROLLUP_SQL:
+            conn.execute(sql, (first_id, last_id))
+    _invalidate_reads()
+    return list(range(first_id, last_id + 1))
+
 
+# Single writer thread: records queued by concurrent requests are drained (up to
+# WRITE_BATCH_MAX, or whatever arrives within WRITE_LINGER_S) and committed together,
+# so N requests cost one transaction instead of N.
+WRITE_BATCH_MAX = 256
+WRITE_LINGER_S = 0.005
+_write_queue: "queue.Queue[Optional[Tuple[UsageRecord, Future]]]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
 
-def recent_usage(limit: int = 50) -> List[sqlite3.Row]:
+
+def _resolve(fut: Future, result: Any = None, exc: Optional[BaseException] = None) -> None:
+    # Never let one bad future take the writer thread (and every queued request) down with it.
+    try:
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _writer_loop() -> None:
+    while True:
+        item = _write_queue.get()
+        if item is None:
+            return
+        items = [item]
+        deadline = time.monotonic() + WRITE_LINGER_S
+        while len(items) < WRITE_BATCH_MAX:
+            try:
+                item = _write_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                _write_queue.put(None)
+                break
+            items.append(item)
+        # Drop requests cancelled while queued; the rest are marked running and can no longer be cancelled.
+        batch = [(record, fut) for record, fut in items if fut.set_running_or_notify_cancel()]
+        if not batch:
+            continue
+        try:
+            ids = insert_usage([record for record, _ in batch])
+        except Exception:
+            # The whole transaction rolled back; retry one by one so only the bad record's request fails.
+            for record, fut in batch:
+                try:
+                    _resolve(fut, insert_usage([record])[0])
+                except Exception as exc:
+                    _resolve(fut, exc=exc)
+        else:
+            for (_, fut), new_id in zip(batch, ids):
+                _resolve(fut, new_id)
+
+
+def start_writer() -> None:
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="usage-writer", daemon=True)
+            _writer.start()
+
+
+def enqueue_usage(record: UsageRecord) -> "Future[int]":
+    start_writer()
+    fut: Future = Future()
+    _write_queue.put((record, fut))
+    return fut
+
+
+def recent_usage(limit: int = 50, columns: Sequence[str] = ("*",)) -> List[Tuple[Any, ...]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT * FROM usage
+        # Plain tuples: callers zip them with `columns` once instead of sqlite3.Row name lookups per field.
+        cur = conn.cursor()
+        cur.row_factory = None
+        cur.execute(
+            f"""
+            SELECT {", ".join(columns)} FROM usage
             ORDER BY created_at DESC, id DESC
             LIMIT ?
             """,
@@ -64,87 +296,114 @@ def recent_usage(limit: int = 50) -> List[sqlite3.Row]:
         return cur.fetchall()
 
 
+# Dashboards poll /summary and /timeseries; identical reads are served from memory until
+# this process inserts usage or READ_CACHE_TTL_S passes (which bounds staleness from
+# writes made by other processes).
+READ_CACHE_TTL_S = 1.0
+READ_CACHE_MAX = 256
+_read_cache: Dict[Tuple[Any, ...], Tuple[float, int, Any]] = {}
+_write_generation = 0
+
+
+def _invalidate_reads() -> None:
+    global _write_generation
+    _write_generation += 1
+
+
+def _cached_read(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        hit = _read_cache.get(key)
+        if hit is not None and hit[1] == _write_generation and now - hit[0] < READ_CACHE_TTL_S:
+            return hit[2]
+        generation = _write_generation
+        result = fn(*args, **kwargs)
+        if len(_read_cache) >= READ_CACHE_MAX:
+            _read_cache.clear()
+        _read_cache[key] = (now, generation, result)
+        return result
+
+    return wrapper
+
+
+@_cached_read
 def aggregate_summary(start_iso: Optional[str], end_iso: Optional[str]) -> Dict[str, Any]:
+    # Day-aligned windows (all period_bounds() produce these) are answered from the daily
+    # rollup; arbitrary timestamps still need the raw rows.
+    if all(b is None or _DATE_ONLY.fullmatch(b) for b in (start_iso, end_iso)):
+        source, column = "usage_daily", "bucket"
+    else:
+        source, column = "usage", "created_at"
+
     with get_conn() as conn:
         where = []
         params: Tuple[Any, ...] = tuple()
         if start_iso:
-            where.append("created_at >= ?")
+            where.append(f"{column} >= ?")
             params += (start_iso,)
         if end_iso:
-            where.append("created_at < ?")
+            where.append(f"{column} < ?")
             params += (end_iso,)
         where_sql = (" WHERE " + " AND ".join(where)) if where else ""
 
-        # totals
-        total = conn.execute(
-            f"SELECT COALESCE(SUM(cost),0.0) AS cost, COALESCE(SUM(input_tokens+output_tokens),0) AS tokens, COALESCE(SUM(calls),0) AS calls FROM usage{where_sql}",
-            params,
-        ).fetchone()
-
-        # by provider
-        by_provider_rows = conn.execute(
-            f"SELECT provider, COALESCE(SUM(cost),0.0) AS cost, COALESCE(SUM(input_tokens+output_tokens),0) AS tokens, COALESCE(SUM(calls),0) AS calls FROM usage{where_sql} GROUP BY provider",
+        # One pass grouped by provider; the grand total is the sum of those few rows.
+        rows = conn.execute(
+            f"SELECT provider, SUM(cost) AS cost, SUM(tokens) AS tokens, SUM(calls) AS calls FROM {source}{where_sql} GROUP BY provider",
             params,
         ).fetchall()
-        by_provider = {row["provider"]: {"cost": row["cost"], "tokens": row["tokens"], "calls": row["calls"]} for row in by_provider_rows}
+        by_provider = {row["provider"]: {"cost": row["cost"], "tokens": row["tokens"], "calls": row["calls"]} for row in rows}
 
         return {
-            "total": {"cost": total["cost"], "tokens": total["tokens"], "calls": total["calls"]},
+            "total": {
+                "cost": sum((p["cost"] for p in by_provider.values()), 0.0),
+                "tokens": sum(p["tokens"] for p in by_provider.values()),
+                "calls": sum(p["calls"] for p in by_provider.values()),
+            },
             "by_provider": by_provider,
         }
 
 
+@_cached_read
 def timeseries(granularity: str = "day", days: int = 7, provider: Optional[str] = None) -> List[Dict[str, Any]]:
     granularity = granularity.lower()
     if granularity not in ("hour", "day"):
         granularity = "day"
 
+    params: Tuple[Any, ...] = (f"-{days} days",)
+    if provider:
+        params += (provider,)
     with get_conn() as conn:
-        group_fmt = "%Y-%m-%d" if granularity == "day" else "%Y-%m-%d %H:00"
-        where = ["created_at >= datetime('now', ?)"]
-        params: Tuple[Any, ...] = (f"-{days} days",)
-        if provider:
-            where.append("provider = ?")
-            params += (provider,)
-        where_sql = " WHERE " + " AND ".join(where)
-
-        cur = conn.execute(
-            f"""
-            SELECT strftime('{group_fmt}', created_at) AS bucket,
-                   COALESCE(SUM(cost),0.0) AS cost,
-                   COALESCE(SUM(input_tokens+output_tokens),0) AS tokens,
-                   COALESCE(SUM(calls),0) AS calls
-            FROM usage
-            {where_sql}
-            GROUP BY bucket
-            ORDER BY bucket ASC
-            """,
-            params,
-        )
-        rows = cur.fetchall()
+        rows = conn.execute(TIMESERIES_SQL[(granularity, bool(provider))], params).fetchall()
         return [dict(row) for row in rows]
 
 
-def period_bounds(period: str) -> Tuple[Optional[str], Optional[str]]:
-    period = period.lower()
+@lru_cache(maxsize=32)
+def _period_bounds_for(period: str, today: date) -> Tuple[Optional[str], Optional[str]]:
     if period == "day":
-        start = "date('now')"
-        end = "date('now','+1 day')"
+        start, end = today, today + timedelta(days=1)
     elif period == "week":
-        start = "date('now','-6 days')"
-        end = "date('now','+1 day')"
+        start, end = today - timedelta(days=6), today + timedelta(days=1)
     elif period == "month":
-        start = "date('now','start of month')"
-        end = "date('now','start of month','+1 month')"
+        start = today.replace(day=1)
+        end = start + timedelta(days=calendar.monthrange(start.year, start.month)[1])
     else:
-        start = None
-        end = None
+        return None, None
+    return start.isoformat(), end.isoformat()
+
+
+def period_bounds(period: str) -> Tuple[Optional[str], Optional[str]]:
+    # UTC, matching SQLite's date('now') and the created_at default.
+    return _period_bounds_for(period.lower(), datetime.utcnow().date())
 
-    def eval_expr(expr: Optional[str]) -> Optional[str]:
-        if not expr:
-            return None
-        with get_conn() as conn:
-            return conn.execute(f"SELECT {expr} AS d").fetchone()["d"]
 
-    return eval_expr(start), eval_expr(end)
+@atexit.register
+def close_all() -> None:
+    if _writer is not None and _writer.is_alive():
+        _write_queue.put(None)
+        _writer.join(timeout=5)
+    with _open_conns_lock:
+        for _, conn in _open_conns:
+            conn.close()
+        _open_conns.clear()
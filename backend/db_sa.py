@@ -1,6 +1,8 @@
 from __future__ import annotations
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import QueuePool
 from .config import settings
 
 
@@ -8,7 +10,39 @@ class Base(DeclarativeBase):
     pass
 
 
-ENGINE = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+def _make_engine():
+    """Returns (engine, pool_pre_ping) so callers can inspect the pool config without private pool state."""
+    url = make_url(settings.DATABASE_URL)
+    # query_cache_size sizes the engine-wide compiled statement cache shared by all sessions,
+    # so repeated router queries skip SQL compilation.
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return create_engine(url, pool_pre_ping=True, query_cache_size=1200), True
+
+    # File-backed SQLite: a real pool instead of SingletonThreadPool so FastAPI's
+    # threadpool workers each get their own connection.
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=False,
+        query_cache_size=1200,
+        # sqlite3's timeout is the busy wait on a locked database (same 5s as backend/db.py)
+        connect_args={"check_same_thread": False, "timeout": 5},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA foreign_keys=ON")
+        cur.close()
+
+    return engine, False
+
+
+ENGINE, POOL_PRE_PING = _make_engine()
 SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, autocommit=False)
 
 
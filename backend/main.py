@@ -1,10 +1,13 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import anyio
+import orjson
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional
-from datetime import datetime
+from typing import Annotated, Any, Dict, List, Literal, Optional
+from datetime import datetime, timezone
 
-from .db import init_db, insert_usage, recent_usage, aggregate_summary, timeseries, period_bounds
+from .db import WRITE_BATCH_MAX, UsageRecord, init_db, start_writer, enqueue_usage, insert_usage, recent_usage, aggregate_summary, timeseries, period_bounds
 from .config import settings
 from .db_sa import ENGINE
 from .models import Base
@@ -15,6 +18,19 @@ from .routers.billing import router as billing_router
 # Pricing (example; adjust as needed)
 GROQ_PRICE_PER_1K = 0.001  # $ per 1K tokens
 GEMINI_PRICE_PER_1K = 0.0014  # $ per 1K tokens
+# Folded once at import so the hot path is a single multiply
+GROQ_PRICE_PER_TOKEN = GROQ_PRICE_PER_1K / 1000.0
+GEMINI_PRICE_PER_TOKEN = GEMINI_PRICE_PER_1K / 1000.0
+PRICES_PER_TOKEN = {"groq": GROQ_PRICE_PER_TOKEN, "gemini": GEMINI_PRICE_PER_TOKEN}
+
+# sqlite3 calls block, so endpoints run them on worker threads; the limiter caps how many
+# threads a burst of DB work can occupy and keeps the event loop responsive.
+_db_limiter = anyio.CapacityLimiter(20)
+
+
+async def _run_db(fn, *args):
+    return await anyio.to_thread.run_sync(fn, *args, limiter=_db_limiter)
+
 
 app = FastAPI(title="AI Cost Tracker (Groq + Gemini)")
 
@@ -28,15 +44,23 @@ app.add_middleware(
 )
 
 
+# Keeps counts (and input + output) well inside SQLite's 64-bit INTEGER
+MAX_COUNT = 2**31 - 1
+
+
 class TrackRequest(BaseModel):
     user_id: str = Field(default="demo-user")
     model: str
-    input_tokens: int = 0
-    output_tokens: int = 0
-    calls: int = 1
+    input_tokens: int = Field(default=0, ge=0, le=MAX_COUNT)
+    output_tokens: int = Field(default=0, ge=0, le=MAX_COUNT)
+    calls: int = Field(default=1, ge=0, le=MAX_COUNT)
     created_at: Optional[datetime] = None
 
 
+class TrackBulkItem(TrackRequest):
+    provider: Literal["groq", "gemini"]
+
+
 class TrackResponse(BaseModel):
     id: int
     provider: str
@@ -51,6 +75,7 @@ class TrackResponse(BaseModel):
 async def on_startup():
     # Initialize lightweight SQLite usage DB (legacy endpoints)
     init_db()
+    start_writer()
     # Create SQLAlchemy tables for expanded features
     Base.metadata.create_all(bind=ENGINE)
     # Mount routers
@@ -64,82 +89,75 @@ async def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
-def _calc_cost(tokens: int, price_per_1k: float) -> float:
-    return round((tokens / 1000.0) * price_per_1k, 8)
-
-
-@app.post("/track/groq", response_model=TrackResponse)
-async def track_groq(req: TrackRequest):
-    total_tokens = max(0, req.input_tokens) + max(0, req.output_tokens)
-    cost = _calc_cost(total_tokens, GROQ_PRICE_PER_1K)
-    rec = {
-        "user_id": req.user_id,
-        "provider": "groq",
-        "model": req.model,
-        "input_tokens": req.input_tokens,
-        "output_tokens": req.output_tokens,
-        "calls": req.calls,
-        "cost": cost,
-        "created_at": req.created_at.isoformat() if req.created_at else None,
-    }
-    new_id = insert_usage(rec)
-    return TrackResponse(
-        id=new_id,
-        provider="groq",
-        model=req.model,
-        tokens=total_tokens,
-        calls=req.calls,
-        cost=cost,
-        created_at=req.created_at or datetime.utcnow(),
-    )
-
-
-@app.post("/track/gemini", response_model=TrackResponse)
-async def track_gemini(req: TrackRequest):
-    total_tokens = max(0, req.input_tokens) + max(0, req.output_tokens)
-    cost = _calc_cost(total_tokens, GEMINI_PRICE_PER_1K)
-    rec = {
-        "user_id": req.user_id,
-        "provider": "gemini",
-        "model": req.model,
-        "input_tokens": req.input_tokens,
-        "output_tokens": req.output_tokens,
-        "calls": req.calls,
-        "cost": cost,
-        "created_at": req.created_at.isoformat() if req.created_at else None,
-    }
-    new_id = insert_usage(rec)
-    return TrackResponse(
-        id=new_id,
-        provider="gemini",
-        model=req.model,
-        tokens=total_tokens,
-        calls=req.calls,
-        cost=cost,
-        created_at=req.created_at or datetime.utcnow(),
-    )
+def _db_timestamp(dt: datetime) -> str:
+    # SQLite's datetime('now') layout (naive UTC, space separator) so client-supplied times
+    # sort with DB-defaulted rows and read back through the TIMESTAMP converter.
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(" ")
+
+
+def _usage_record(req: TrackRequest, provider: str, cost: float) -> UsageRecord:
+    # Missing created_at stays None: the INSERT defaults it to datetime('now') in SQLite.
+    created_at = _db_timestamp(req.created_at) if req.created_at else None
+    return (req.user_id, provider, req.model, req.input_tokens, req.output_tokens, req.calls, cost, created_at)
+
+
+def _make_track_endpoint(provider: str, price_per_token: float):
+    # provider and price are closure cells baked into each endpoint, not per-request lookups
+    async def track(req: TrackRequest):
+        total_tokens = max(0, req.input_tokens) + max(0, req.output_tokens)
+        cost = round(total_tokens * price_per_token, 8)
+        new_id = await asyncio.wrap_future(enqueue_usage(_usage_record(req, provider, cost)))
+        return TrackResponse(
+            id=new_id,
+            provider=provider,
+            model=req.model,
+            tokens=total_tokens,
+            calls=req.calls,
+            cost=cost,
+            created_at=req.created_at or datetime.utcnow(),
+        )
+
+    track.__name__ = f"track_{provider}"
+    return track
+
+
+track_groq = app.post("/track/groq", response_model=TrackResponse)(_make_track_endpoint("groq", GROQ_PRICE_PER_TOKEN))
+track_gemini = app.post("/track/gemini", response_model=TrackResponse)(_make_track_endpoint("gemini", GEMINI_PRICE_PER_TOKEN))
+
+
+@app.post("/track/bulk", response_model=List[TrackResponse])
+async def track_bulk(items: Annotated[List[TrackBulkItem], Field(max_length=WRITE_BATCH_MAX)]):
+    # One transaction for the whole batch, bypassing the single-record writer queue. Capped like a
+    # writer batch so one request can't hold the write lock long enough to stall /track past busy_timeout.
+    costs = [round((max(0, it.input_tokens) + max(0, it.output_tokens)) * PRICES_PER_TOKEN[it.provider], 8) for it in items]
+    new_ids = await _run_db(insert_usage, [_usage_record(it, it.provider, cost) for it, cost in zip(items, costs)])
+    now = datetime.utcnow()
+    return [
+        TrackResponse(
+            id=new_id,
+            provider=it.provider,
+            model=it.model,
+            tokens=max(0, it.input_tokens) + max(0, it.output_tokens),
+            calls=it.calls,
+            cost=cost,
+            created_at=it.created_at or now,
+        )
+        for it, cost, new_id in zip(items, costs, new_ids)
+    ]
+
+
+RECENT_COLUMNS = ("id", "user_id", "provider", "model", "input_tokens", "output_tokens", "calls", "cost", "created_at")
 
 
 @app.get("/recent")
-async def get_recent(limit: int = 50) -> Dict[str, Any]:
+async def get_recent(limit: int = 50) -> Response:
     limit = max(1, min(limit, 200))
-    rows = recent_usage(limit)
-    return {
-        "items": [
-            {
-                "id": r["id"],
-                "user_id": r["user_id"],
-                "provider": r["provider"],
-                "model": r["model"],
-                "input_tokens": r["input_tokens"],
-                "output_tokens": r["output_tokens"],
-                "calls": r["calls"],
-                "cost": r["cost"],
-                "created_at": r["created_at"],
-            }
-            for r in rows
-        ]
-    }
+    rows = await _run_db(recent_usage, limit, RECENT_COLUMNS)
+    # Serialized straight to bytes; created_at values are naive UTC from SQLite.
+    body = orjson.dumps({"items": [dict(zip(RECENT_COLUMNS, row)) for row in rows]}, option=orjson.OPT_NAIVE_UTC)
+    return Response(content=body, media_type="application/json")
 
 
 @app.get("/summary")
@@ -149,22 +167,22 @@ async def get_summary(period: Optional[str] = None, start: Optional[str] = None,
 
     if period:
         start, end = period_bounds(period)
-    data = aggregate_summary(start, end)
-    data["window"] = {"start": start, "end": end}
-    return data
+    data = await _run_db(aggregate_summary, start, end)
+    # aggregate_summary results are cached and shared; build a new dict rather than mutating
+    return {**data, "window": {"start": start, "end": end}}
 
 
 @app.get("/timeseries")
 async def get_timeseries(granularity: str = "day", days: int = 7, provider: Optional[str] = None) -> Dict[str, Any]:
     days = max(1, min(days, 90))
-    series = timeseries(granularity=granularity, days=days, provider=provider)
+    series = await _run_db(timeseries, granularity, days, provider)
     return {"granularity": granularity, "days": days, "provider": provider, "series": series}
 
 
 @app.get("/alerts")
 async def get_alerts(threshold: float = 10.0, period: str = "day") -> Dict[str, Any]:
     start, end = period_bounds(period)
-    data = aggregate_summary(start, end)
+    data = await _run_db(aggregate_summary, start, end)
     over = data["total"]["cost"] >= threshold
     return {
         "period": period,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Integer, Float, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import String, Integer, Float, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db_sa import Base
 
@@ -22,6 +22,10 @@ class Customer(Base):
 
 class AgentRun(Base):
     __tablename__ = "agent_runs"
+    __table_args__ = (
+        # Covers billing's per-customer period SUM(cost_usd) and run_summary without touching the table
+        Index("ix_agent_runs_customer_started", "customer_id", "started_at", "cost_usd", "success"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id", ondelete="CASCADE"), index=True)
@@ -48,6 +52,8 @@ class ToolCall(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     agent_run_id: Mapped[int] = mapped_column(ForeignKey("agent_runs.id", ondelete="CASCADE"), index=True)
+    # Client-generated so hooks can hand out a handle before the row is inserted
+    call_uuid: Mapped[Optional[str]] = mapped_column(String(36), index=True)
     tool_name: Mapped[str] = mapped_column(String(255))
     started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     ended_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
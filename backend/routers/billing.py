@@ -3,11 +3,11 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, func, select, update
 
 from ..db_sa import get_db
 from ..models import Customer, AgentRun, BillingEvent
-from ..services.stripe_service import create_stripe_customer, create_and_finalize_invoice
+from ..services.stripe_service import create_stripe_customer, create_auto_advancing_invoice, from_usd
 
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -24,43 +24,54 @@ class InvoiceCreate(BaseModel):
 
 @router.post("/stripe/create_customer")
 async def create_stripe_customer_route(body: StripeCustomerCreate, db: Session = Depends(get_db)):
-    cust = db.get(Customer, body.customer_id)
-    if not cust:
+    # Only the columns needed, no ORM hydration; the common case returns right here.
+    row = db.execute(
+        select(Customer.stripe_customer_id, Customer.name, Customer.email).where(Customer.id == body.customer_id)
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Customer not found")
-    if cust.stripe_customer_id:
-        return {"stripe_customer_id": cust.stripe_customer_id}
+    if row.stripe_customer_id:
+        return {"stripe_customer_id": row.stripe_customer_id}
 
-    stripe_id = create_stripe_customer(name=cust.name, email=cust.email)
-    cust.stripe_customer_id = stripe_id
-    db.add(cust)
+    stripe_id = await create_stripe_customer(name=row.name, email=row.email, customer_id=body.customer_id)
+    db.execute(update(Customer).where(Customer.id == body.customer_id).values(stripe_customer_id=stripe_id))
     db.commit()
     return {"stripe_customer_id": stripe_id}
 
 
 @router.post("/invoice/create")
 async def create_invoice(body: InvoiceCreate, db: Session = Depends(get_db)):
-    cust = db.get(Customer, body.customer_id)
-    if not cust:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    if not cust.stripe_customer_id:
-        raise HTTPException(status_code=400, detail="Stripe customer not set for this customer")
-
     period_end = datetime.utcnow()
     period_start = period_end - timedelta(days=body.days)
 
-    totals = db.query(func.coalesce(func.sum(AgentRun.cost_usd), 0.0)).filter(
-        AgentRun.customer_id == body.customer_id,
-        AgentRun.started_at >= period_start,
-        AgentRun.started_at < period_end,
-    ).scalar() or 0.0
+    # Customer lookup and period cost in one round trip
+    row = db.execute(
+        select(Customer.stripe_customer_id, func.coalesce(func.sum(AgentRun.cost_usd), 0.0))
+        .outerjoin(
+            AgentRun,
+            and_(
+                AgentRun.customer_id == Customer.id,
+                AgentRun.started_at >= period_start,
+                AgentRun.started_at < period_end,
+            ),
+        )
+        .where(Customer.id == body.customer_id)
+        .group_by(Customer.id)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    stripe_customer_id, totals = row
+    if not stripe_customer_id:
+        raise HTTPException(status_code=400, detail="Stripe customer not set for this customer")
 
-    subtotal = float(totals)
+    subtotal = float(totals or 0.0)
     total = round(subtotal * (1.0 + body.margin_percent / 100.0), 4)
 
-    invoice_id = create_and_finalize_invoice(
-        customer_id=cust.stripe_customer_id,
+    # Stripe returns the invoice as a draft and auto-finalizes it about an hour later
+    invoice_id, invoice_status = await create_auto_advancing_invoice(
+        customer_id=stripe_customer_id,
         description=f"AI Agent usage {period_start.date()} - {period_end.date()} (incl. margin {body.margin_percent}%)",
-        amount_usd=total,
+        amount_cents=from_usd(total),
     )
 
     be = BillingEvent(
@@ -77,6 +88,7 @@ async def create_invoice(body: InvoiceCreate, db: Session = Depends(get_db)):
 
     return {
         "stripe_invoice_id": invoice_id,
+        "stripe_invoice_status": invoice_status,
         "subtotal_usd": subtotal,
         "margin_percent": body.margin_percent,
         "total_usd": total,
@@ -1,14 +1,15 @@
 from __future__ import annotations
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
-from ..db_sa import get_db
+from ..db_sa import get_db, SessionLocal
 from ..models import AgentRun
 from ..services.portia_factory import make_portia
-from sqlalchemy import func, Integer, cast
+from sqlalchemy import case, func, select
 import logging
 
 router = APIRouter(prefix="/runs", tags=["runs"])
@@ -78,23 +79,48 @@ async def start_run(body: StartRunRequest, bg: BackgroundTasks, db: Session = De
 
 
 @router.get("/by_customer/{customer_id}", response_model=List[AgentRunOut])
-async def list_runs(customer_id: int, db: Session = Depends(get_db)):
-    q = db.query(AgentRun).filter(AgentRun.customer_id == customer_id).order_by(AgentRun.started_at.desc())
-    return q.all()
+async def list_runs(
+    customer_id: int,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    stream: bool = False,
+    db: Session = Depends(get_db),
+):
+    # Keyset pagination, newest first: pass the last returned id as `cursor` for the next page.
+    stmt = select(AgentRun).where(AgentRun.customer_id == customer_id)
+    if cursor is not None:
+        stmt = stmt.where(AgentRun.id < cursor)
+    stmt = stmt.order_by(AgentRun.id.desc()).limit(limit)
+
+    if stream:
+        def _ndjson():
+            # Own session: the request-scoped one may be closed before the body is sent
+            sess = SessionLocal()
+            try:
+                for run in sess.scalars(stmt.execution_options(yield_per=100)):
+                    yield AgentRunOut.model_validate(run).model_dump_json() + "\n"
+            finally:
+                sess.close()
+
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+    return db.scalars(stmt).all()
 
 
 @router.get("/summary/{customer_id}")
 async def run_summary(customer_id: int, db: Session = Depends(get_db)) -> Dict[str, Any]:
-    totals = db.query(
-        func.count(AgentRun.id),
-        func.sum(AgentRun.cost_usd),
-        func.avg(AgentRun.cost_usd),
-        func.avg(cast(AgentRun.success, Integer)),
-    ).filter(AgentRun.customer_id == customer_id).one()
-    count = totals[0] or 0
+    # Plain sums only (no per-row CAST) so the covering index answers it; averages derived below.
+    count, total_cost, successes = db.execute(
+        select(
+            func.count(AgentRun.id),
+            func.coalesce(func.sum(AgentRun.cost_usd), 0.0),
+            func.coalesce(func.sum(case((AgentRun.success, 1), else_=0)), 0),
+        ).where(AgentRun.customer_id == customer_id)
+    ).one()
+    count = count or 0
     return {
         "total_runs": count,
-        "total_cost_usd": float(totals[1] or 0.0),
-        "avg_cost_usd": float(totals[2] or 0.0),
-        "success_rate": float(totals[3] or 0.0) if count > 0 else 0.0,
+        "total_cost_usd": float(total_cost),
+        "avg_cost_usd": float(total_cost) / count if count > 0 else 0.0,
+        "success_rate": successes / count if count > 0 else 0.0,
     }
@@ -0,0 +1,44 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Optional, Tuple
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from ..models import AgentRun
+from .portia_factory import make_portia
+from .stripe_service import create_stripe_customer
+
+
+async def prepare_billing_and_agent(
+    db: Session,
+    customer_id: int,
+    name: str,
+    email: Optional[str],
+    prompt: str,
+    provider: str = "google",
+    model: str = "google/gemini-2.0-flash",
+) -> Tuple[Any, AgentRun, str]:
+    """Create the Stripe customer and start an AgentRun concurrently; returns (portia, run, stripe_customer_id).
+
+    Storing the Stripe id on the Customer row is left to the caller, since ``db`` is busy in the worker thread.
+    """
+    # Stripe is natively async; make_portia does a blocking DB insert, so it runs in a worker thread.
+    # Both are awaited to completion before raising, so ``db`` is never handed back while the thread uses it.
+    stripe_res, portia_res = await asyncio.gather(
+        create_stripe_customer(name=name, email=email, customer_id=customer_id),
+        asyncio.to_thread(make_portia, db, customer_id, prompt, provider, model),
+        return_exceptions=True,
+    )
+    if isinstance(portia_res, BaseException):
+        raise portia_res
+    portia, ar = portia_res
+    if isinstance(stripe_res, BaseException):
+        # Don't leave a run behind for an onboarding that failed
+        await asyncio.to_thread(_discard_run, db, ar.id)
+        raise stripe_res
+    return portia, ar, stripe_res
+
+
+def _discard_run(db: Session, run_id: int) -> None:
+    db.execute(delete(AgentRun).where(AgentRun.id == run_id))
+    db.commit()
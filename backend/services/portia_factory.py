@@ -1,73 +1,135 @@
 from __future__ import annotations
-from datetime import datetime
-from typing import Optional
-from sqlalchemy.orm import Session
+import asyncio
+import functools
+import importlib.util
+import inspect
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+from sqlalchemy import insert, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.pool import QueuePool
 
 from ..config import settings
+from ..db_sa import ENGINE, POOL_PRE_PING
 from ..models import AgentRun, ToolCall
 
-try:
-    # Portia SDK imports
-    from portia import (
-        Config as PortiaConfig,
-        LLMProvider,
-        Portia as PortiaClient,
-        example_tool_registry,
+# Portia (and the LLM SDKs it pulls in) is only imported on the first make_portia call;
+# processes that never start a run don't pay for it.
+_HAS_PORTIA = importlib.util.find_spec("portia") is not None
+
+# Provider str -> LLMProvider member name, and the key kwargs shared by every config; both fixed for the process
+_PROV_NAMES = {"google": "GOOGLE", "openai": "OPENAI", "anthropic": "ANTHROPIC", "groq": "GROQ"}
+_BASE_CFG_KWARGS = {
+    k: v
+    for k, v in (
+        ("google_api_key", settings.GOOGLE_API_KEY),
+        ("openai_api_key", settings.OPENAI_API_KEY),
+        ("anthropic_api_key", settings.ANTHROPIC_API_KEY),
     )
-except Exception:  # pragma: no cover
-    PortiaClient = None  # type: ignore
-    LLMProvider = None  # type: ignore
-    PortiaConfig = None  # type: ignore
-    example_tool_registry = None  # type: ignore
+    if v
+}
+
+
+def _check_pool(engine: Engine, pre_ping: bool) -> None:
+    # CostHooks commit per plan from many workers at once; warn early if that would queue on the pool.
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        logging.warning("DB engine uses %s, not QueuePool; hook commits won't reuse pooled connections", type(pool).__name__)
+        return
+    if pool.size() < settings.WORKERS:
+        logging.warning("DB pool_size=%d is below WORKERS=%d; hook commits will wait for connections", pool.size(), settings.WORKERS)
+    if engine.dialect.name != "sqlite" and not pre_ping:
+        logging.warning("DB engine has pool_pre_ping disabled; stale connections will surface as errors")
+
+
+_check_pool(ENGINE, POOL_PRE_PING)
+
+
+def _utcnow() -> datetime:
+    # The DateTime columns are naive UTC; an aware value would be shifted by the session
+    # time zone on Postgres (timestamptz -> timestamp cast), so drop tzinfo before binding.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class CostHooks:
+    # Tool calls and AgentRun rollups are buffered in memory and written in one transaction
+    # per plan; FLUSH_EVERY bounds how much a crash mid-plan can lose.
+    FLUSH_EVERY = 50
+    # Created per run; slots skip the per-instance __dict__
+    __slots__ = (
+        "db",
+        "agent_run",
+        "_run_id",
+        "_calls",
+        "_pending_calls",
+        "_rollup",
+        "_start_ns",
+        "_plan_start_ns",
+    )
+
     def __init__(self, db: Session, agent_run: AgentRun):
         self.db = db
         self.agent_run = agent_run
+        # Read once: after a commit the instance is expired and touching it would re-SELECT the row
+        self._run_id = agent_run.id
+        self._calls: dict[str, ToolCall] = {}
+        self._pending_calls: list[ToolCall] = []
+        self._rollup = {"calls": 0, "input": 0, "output": 0, "cost": 0.0}
+        # Durations come from the monotonic clock; datetimes are only kept for the DB columns
+        self._start_ns: dict[str, int] = {}
+        self._plan_start_ns: Optional[int] = None
 
     def before_plan_run(self, **kwargs):
-        self.agent_run.started_at = datetime.utcnow()
-        self.db.add(self.agent_run)
+        self._plan_start_ns = time.perf_counter_ns()
+        self.db.execute(update(AgentRun).where(AgentRun.id == self._run_id).values(started_at=_utcnow()))
         self.db.commit()
 
-    def before_tool_call(self, tool_name: str, **kwargs):
+    def before_tool_call(self, tool_name: str, **kwargs) -> str:
         call = ToolCall(
-            agent_run_id=self.agent_run.id,
+            agent_run_id=self._run_id,
+            call_uuid=str(uuid.uuid4()),
             tool_name=tool_name,
-            started_at=datetime.utcnow(),
+            started_at=_utcnow(),
             status="running",
         )
-        self.db.add(call)
-        self.db.commit()
-        return call.id
+        self._calls[call.call_uuid] = call
+        self._start_ns[call.call_uuid] = time.perf_counter_ns()
+        self._pending_calls.append(call)
+        return call.call_uuid
 
     def after_tool_call(
         self,
-        tool_call_id: int,
+        tool_call_id: str,
         input_tokens: int = 0,
         output_tokens: int = 0,
         cost_usd: float = 0.0,
         status: str = "ok",
         **kwargs,
     ):
-        call: ToolCall = self.db.get(ToolCall, tool_call_id)
+        self._end_call(tool_call_id, input_tokens, output_tokens, cost_usd, status)
+        if len(self._pending_calls) >= self.FLUSH_EVERY:
+            self._commit_pending()
+
+    def _end_call(self, tool_call_id: str, input_tokens: int, output_tokens: int, cost_usd: float, status: str) -> None:
+        # In-memory only: finish the buffered ToolCall and add it to the rollup
+        call = self._calls.pop(tool_call_id, None)
+        start_ns = self._start_ns.pop(tool_call_id, None)
         if call:
-            call.ended_at = datetime.utcnow()
-            if call.started_at and call.ended_at:
-                call.duration_ms = int((call.ended_at - call.started_at).total_seconds() * 1000)
+            call.ended_at = _utcnow()
+            if start_ns is not None:
+                call.duration_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
             call.input_tokens = input_tokens
             call.output_tokens = output_tokens
             call.cost_usd = cost_usd
             call.status = status
-            self.db.add(call)
-        # Update rollups on AgentRun
-        self.agent_run.calls += 1
-        self.agent_run.input_tokens += input_tokens
-        self.agent_run.output_tokens += output_tokens
-        self.agent_run.cost_usd += cost_usd
-        self.db.add(self.agent_run)
-        self.db.commit()
+        self._rollup["calls"] += 1
+        self._rollup["input"] += input_tokens
+        self._rollup["output"] += output_tokens
+        self._rollup["cost"] += cost_usd
 
     def after_plan_run(
         self,
@@ -76,74 +138,199 @@ class CostHooks:
         model: Optional[str] = None,
         **kwargs,
     ):
-        self.agent_run.success = success
-        self.agent_run.provider = provider or self.agent_run.provider
-        self.agent_run.model = model or self.agent_run.model
-        self.agent_run.ended_at = datetime.utcnow()
-        if self.agent_run.started_at and self.agent_run.ended_at:
-            self.agent_run.duration_ms = int((self.agent_run.ended_at - self.agent_run.started_at).total_seconds() * 1000)
-        self.db.add(self.agent_run)
+        self._flush()
+        now = _utcnow()
+        values = {"success": success, "ended_at": now}
+        if provider:
+            values["provider"] = provider
+        if model:
+            values["model"] = model
+        if self._plan_start_ns is not None:
+            values["duration_ms"] = (time.perf_counter_ns() - self._plan_start_ns) // 1_000_000
+        elif self.agent_run.started_at:
+            values["duration_ms"] = int((now - self.agent_run.started_at).total_seconds() * 1000)
+        self.db.execute(update(AgentRun).where(AgentRun.id == self._run_id).values(**values))
         self.db.commit()
 
+    def _commit_pending(self) -> None:
+        self._flush()
+        self.db.commit()
 
-def make_portia(db: Session, customer_id: int, prompt: str, provider: str = "google", model: str = "google/gemini-2.0-flash"):
-    """Factory that returns a Portia instance (or Dummy) and a new AgentRun. Robust to SDK/config issues."""
-    # Fallback runner that simulates a run without external API calls
-    class DummyPortia:
-        def run(self, _prompt: str):
-            import time
-            time.sleep(0.2)
-            return {"ok": True}
+    def _flush(self) -> None:
+        # Stage buffered tool calls and rollups in the session; the caller commits.
+        # Calls still running stay in self._calls and keep being tracked once added.
+        self.db.add_all(self._pending_calls)
+        self._pending_calls.clear()
+        rollup = self._rollup
+        if rollup["calls"]:
+            # Relative UPDATE so concurrent writers to the same run don't overwrite each other
+            self.db.execute(
+                update(AgentRun)
+                .where(AgentRun.id == self._run_id)
+                .values(
+                    calls=AgentRun.calls + rollup["calls"],
+                    input_tokens=AgentRun.input_tokens + rollup["input"],
+                    output_tokens=AgentRun.output_tokens + rollup["output"],
+                    cost_usd=AgentRun.cost_usd + rollup["cost"],
+                )
+            )
+        self._rollup = {"calls": 0, "input": 0, "output": 0, "cost": 0.0}
 
-    try:
-        # Create AgentRun
-        ar = AgentRun(customer_id=customer_id, prompt=prompt, provider=provider, model=model)
-        db.add(ar)
-        db.commit()
-        db.refresh(ar)
-
-        # Proceed to try real Portia below; will fallback to DummyPortia on errors
-
-        # Map provider str -> LLMProvider enum
-        prov_map = {
-            "google": getattr(LLMProvider, "GOOGLE", None),
-            "openai": getattr(LLMProvider, "OPENAI", None),
-            "anthropic": getattr(LLMProvider, "ANTHROPIC", None),
-            "groq": getattr(LLMProvider, "GROQ", None),
-        }
-        llm_provider = prov_map.get(provider.lower())
-
-        cfg_kwargs = {"llm_provider": llm_provider, "default_model": model}
-        if settings.GOOGLE_API_KEY:
-            cfg_kwargs["google_api_key"] = settings.GOOGLE_API_KEY
-        if settings.OPENAI_API_KEY:
-            cfg_kwargs["openai_api_key"] = settings.OPENAI_API_KEY
-        if settings.ANTHROPIC_API_KEY:
-            cfg_kwargs["anthropic_api_key"] = settings.ANTHROPIC_API_KEY
-
-        # Build config if possible
-        try:
-            config = PortiaConfig.from_default(**cfg_kwargs)
-        except Exception:
-            config = None
 
-        # Try to instantiate real client; if it fails, use dummy
+class AsyncCostHooks(CostHooks):
+    """CostHooks for async runners that fire independent tool calls concurrently.
+
+    Every hook is a coroutine. Session work (plan start/end and FLUSH_EVERY flushes) runs in a
+    worker thread via asyncio.to_thread so commits don't block the loop; it and the in-memory
+    bookkeeping are serialized by one asyncio.Lock, so the session and the buffers are never
+    touched from two threads at once. Sync tool callables also run in worker threads.
+    Sync runners keep using CostHooks.
+    """
+
+    __slots__ = ("_lock",)
+
+    def __init__(self, db: Session, agent_run: AgentRun):
+        super().__init__(db, agent_run)
+        self._lock = asyncio.Lock()
+
+    async def before_plan_run(self, **kwargs):
+        async with self._lock:
+            await asyncio.to_thread(super().before_plan_run, **kwargs)
+
+    async def before_tool_call(self, tool_name: str, **kwargs) -> str:
+        async with self._lock:
+            return super().before_tool_call(tool_name, **kwargs)
+
+    async def after_tool_call(
+        self,
+        tool_call_id: str,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cost_usd: float = 0.0,
+        status: str = "ok",
+        **kwargs,
+    ):
+        async with self._lock:
+            self._end_call(tool_call_id, input_tokens, output_tokens, cost_usd, status)
+            if len(self._pending_calls) >= self.FLUSH_EVERY:
+                await asyncio.to_thread(self._commit_pending)
+
+    async def after_plan_run(
+        self,
+        success: bool,
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        **kwargs,
+    ):
+        async with self._lock:
+            await asyncio.to_thread(super().after_plan_run, success, provider, model, **kwargs)
+
+    async def wrap(self, tool: Callable[[], Any], tool_name: Optional[str] = None) -> Any:
+        call_id = await self.before_tool_call(tool_name or getattr(tool, "__name__", type(tool).__name__))
         try:
-            if config is not None:
-                portia = PortiaClient(config=config, tools=example_tool_registry)
+            if inspect.iscoroutinefunction(tool):
+                result = await tool()
             else:
-                portia = DummyPortia()
+                result = await asyncio.to_thread(tool)
         except Exception:
-            portia = DummyPortia()
+            await self.after_tool_call(call_id, status="error")
+            raise
+        await self.after_tool_call(call_id)
+        return result
 
-        return portia, ar
-    except Exception:
-        # As a last resort, still create a minimal AgentRun so the API doesn't 500
-        ar = AgentRun(customer_id=customer_id, prompt=prompt, provider=provider, model=model)
-        try:
-            db.add(ar)
-            db.commit()
-            db.refresh(ar)
-        except Exception:
-            pass
+    async def run_tools_parallel(self, tool_invocations: list[Callable[[], Any]]) -> list:
+        # Latency is max(tools) instead of sum(tools); results keep the input order
+        return await asyncio.gather(*(self.wrap(t) for t in tool_invocations))
+
+
+class DummyPortia:
+    """Fallback runner that simulates a run without external API calls."""
+
+    __slots__ = ()
+
+    def run(self, _prompt: str):
+        if settings.DUMMY_SIMULATE_LATENCY_MS:
+            time.sleep(settings.DUMMY_SIMULATE_LATENCY_MS / 1000)
+        return {"ok": True, "dummy": True}
+
+    async def arun(self, _prompt: str):
+        if settings.DUMMY_SIMULATE_LATENCY_MS:
+            await asyncio.sleep(settings.DUMMY_SIMULATE_LATENCY_MS / 1000)
+        return {"ok": True, "dummy": True}
+
+
+@functools.lru_cache(maxsize=1)
+def _portia_sdk():
+    """The imported ``portia`` module, or None if it isn't installed or fails to import."""
+    if not _HAS_PORTIA:
+        return None
+    try:
+        import portia  # type: ignore
+    except Exception:  # pragma: no cover
+        return None
+    return portia
+
+
+# lru_cache only keeps return values, so failures raise instead of returning None: a transient
+# SDK/config error is retried on the next run rather than pinning the pair to DummyPortia.
+@functools.lru_cache(maxsize=8)
+def _config_for(provider: str, model: str):
+    """PortiaConfig for a lowercased provider and model; raises if it can't be built."""
+    sdk = _portia_sdk()
+    llm_provider = getattr(sdk.LLMProvider, _PROV_NAMES[provider], None) if provider in _PROV_NAMES else None
+    if llm_provider is None:
+        raise ValueError(f"Unsupported Portia provider: {provider!r}")
+    return sdk.Config.from_default(**_BASE_CFG_KWARGS, llm_provider=llm_provider, default_model=model)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_portia_client(provider: str, model: str):
+    """Build (once per provider/model) a real Portia client; raises if the SDK/config isn't usable.
+
+    Clients are reused across runs; API keys are read once at import (see ``_BASE_CFG_KWARGS``).
+    """
+    sdk = _portia_sdk()
+    return sdk.Portia(config=_config_for(provider, model), tools=sdk.example_tool_registry)
+
+
+def _create_ar(db: Session, customer_id: int, prompt: str, provider: str, model: str) -> AgentRun:
+    # One INSERT ... RETURNING round-trip; the instance is filled from the values we sent instead of
+    # being refreshed, and attached as detached so later session.add() issues an UPDATE, not an INSERT.
+    values = {
+        "customer_id": customer_id,
+        "prompt": prompt,
+        "provider": provider,
+        "model": model,
+        "started_at": _utcnow(),
+        "ended_at": None,
+        "duration_ms": None,
+        "success": False,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "calls": 0,
+        "cost_usd": 0.0,
+    }
+    run_id = db.execute(insert(AgentRun).values(**values).returning(AgentRun.id)).scalar_one()
+    db.commit()
+    ar = AgentRun(id=run_id, **values)
+    make_transient_to_detached(ar)
+    return ar
+
+
+def make_portia(db: Session, customer_id: int, prompt: str, provider: str = "google", model: str = "google/gemini-2.0-flash"):
+    """Factory that returns a Portia instance (or Dummy) and a new AgentRun. Falls back to Dummy on SDK/config issues.
+
+    ``db`` should come from a pooled engine sized for the worker count, e.g.
+    ``create_engine(url, pool_size=20, max_overflow=40, pool_pre_ping=True, pool_recycle=300)``;
+    a mismatch with ``settings.WORKERS`` is logged at import.
+    """
+    ar = _create_ar(db, customer_id, prompt, provider, model)
+    if _portia_sdk() is None:
         return DummyPortia(), ar
+    try:
+        # Shared per (provider, model)
+        portia = _build_portia_client(provider.lower(), model)
+    except Exception as e:
+        logging.warning("Portia client for %s/%s unavailable, using DummyPortia: %s", provider, model, e)
+        portia = DummyPortia()
+    return portia, ar
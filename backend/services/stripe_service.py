@@ -1,38 +1,124 @@
 from __future__ import annotations
-from typing import Optional
+import hashlib
+import importlib.util
+import json
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, Optional, Tuple
 
 from ..config import settings
 
+# Imported by _init_stripe on the first Stripe call rather than at module import
+_HAS_STRIPE = importlib.util.find_spec("stripe") is not None
+stripe = None  # type: ignore
+
 try:
-    import stripe  # type: ignore
+    import redis.asyncio as aioredis  # type: ignore
 except Exception:  # pragma: no cover
-    stripe = None  # type: ignore
+    aioredis = None  # type: ignore
+
+_INITIALIZED = False
+
+# Optional read-through cache in front of the Stripe API; disabled unless REDIS_URL is set.
+CUSTOMER_ID_TTL_S = 86400
+CUSTOMER_OBJ_TTL_S = 300
+_redis = aioredis.Redis.from_url(settings.REDIS_URL) if aioredis is not None and settings.REDIS_URL else None
 
 
 def _init_stripe() -> None:
-    if stripe is None:
+    global _INITIALIZED, stripe
+    if _INITIALIZED:
+        return
+    if not _HAS_STRIPE:
         raise RuntimeError("Stripe SDK not installed. Add 'stripe' to requirements and pip install.")
     if not settings.STRIPE_API_KEY:
         raise RuntimeError("STRIPE_API_KEY not configured.")
+    import stripe as _stripe  # type: ignore
+
+    stripe = _stripe
     stripe.api_key = settings.STRIPE_API_KEY
+    # httpx backs the *_async methods and keeps a pooled connection to api.stripe.com
+    stripe.default_http_client = stripe.HTTPXClient()
+    _INITIALIZED = True
+
+
+async def _cache_get(key: str) -> Optional[bytes]:
+    if _redis is None:
+        return None
+    try:
+        return await _redis.get(key)
+    except aioredis.RedisError:
+        # Cache is best-effort; fall through to Stripe
+        return None
+
+
+async def _cache_set(key: str, ttl_s: int, value: str) -> None:
+    if _redis is None:
+        return
+    try:
+        await _redis.setex(key, ttl_s, value)
+    except aioredis.RedisError:
+        pass
+
 
+async def create_stripe_customer(name: str, email: Optional[str], customer_id: Optional[int] = None) -> str:
+    # Keyed on the local Customer.id: names and emails aren't unique (email may be null), and a shared
+    # key would hand one customer another's Stripe id. Without an id the cache is skipped.
+    key = f"stripe:cust:local:{customer_id}" if customer_id is not None else None
+    if key:
+        cached = await _cache_get(key)
+        if cached:
+            return cached.decode()
 
-def create_stripe_customer(name: str, email: Optional[str]) -> str:
     _init_stripe()
-    customer = stripe.Customer.create(name=name, email=email)
+    customer = await stripe.Customer.create_async(name=name, email=email)
+    if key:
+        await _cache_set(key, CUSTOMER_ID_TTL_S, customer["id"])
+    await _cache_set(f"stripe:cust:obj:{customer['id']}", CUSTOMER_OBJ_TTL_S, json.dumps(customer.to_dict()))
     return customer["id"]
 
 
-def create_and_finalize_invoice(customer_id: str, description: str, amount_usd: float) -> str:
+async def get_stripe_customer(customer_id: str) -> Dict[str, Any]:
+    key = f"stripe:cust:obj:{customer_id}"
+    cached = await _cache_get(key)
+    if cached:
+        return json.loads(cached)
+
+    _init_stripe()
+    customer = (await stripe.Customer.retrieve_async(customer_id)).to_dict()
+    await _cache_set(key, CUSTOMER_OBJ_TTL_S, json.dumps(customer))
+    return customer
+
+
+def from_usd(amount_usd: float) -> int:
+    """Dollars -> integer cents, rounding half up (float round() is half-even and sees binary error)."""
+    return int((Decimal(str(amount_usd)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+async def create_auto_advancing_invoice(customer_id: str, description: str, amount_cents: int) -> Tuple[str, str]:
+    """Create a one-off invoice for ``amount_cents``; returns (invoice_id, status).
+
+    The invoice comes back as a *draft*: with auto_advance Stripe finalizes it itself about an hour
+    after creation, so it can't be treated as final (or paid) when this returns.
+    """
     _init_stripe()
     # Create product+price on the fly or use a generic meter; here we use one-off invoice item
-    amount_cents = int(round(amount_usd * 100))
-    _ = stripe.InvoiceItem.create(
+    # Deterministic per (customer, description, amount): a retried request replays the
+    # original Stripe responses instead of billing twice.
+    key = hashlib.sha256(f"{customer_id}:{description}:{amount_cents}".encode()).hexdigest()
+    _ = await stripe.InvoiceItem.create_async(
         customer=customer_id,
         amount=amount_cents,
         currency="usd",
         description=description,
+        idempotency_key=key,
+    )
+    # Pulls in the pending item above. auto_advance makes Stripe finalize the draft ~1 hour after
+    # creation (then attempt collection), saving the separate finalize_invoice round trip at the
+    # cost of the invoice staying in draft until then.
+    invoice = await stripe.Invoice.create_async(
+        customer=customer_id,
+        auto_advance=True,
+        pending_invoice_items_behavior="include",
+        idempotency_key=key + ":inv",
     )
-    invoice = stripe.Invoice.create(customer=customer_id, auto_advance=False)
-    finalized = stripe.Invoice.finalize_invoice(invoice["id"])  # type: ignore
-    return finalized["id"]
+    return invoice["id"], invoice["status"]
@@ -1,15 +1,20 @@
 # Compatibility shim for Python < 3.12 to support typing.override
 # This file is auto-imported by Python if present on sys.path.
-# For CLI tools invoked from this project dir, this backfills typing.override
-# using typing_extensions.override when available.
+# For CLI tools invoked from this project dir, this backfills typing.override.
+# It is skipped entirely on 3.12+, and doesn't import typing_extensions at startup:
+# typing_extensions re-exports typing.override when present, so delegating to it
+# from here would recurse. The decorator below is what PEP 698 specifies.
 
+import sys
 import typing
 
-try:
-    from typing_extensions import override as _override  # type: ignore
-    if not hasattr(typing, "override"):
-        # Attach attribute for libraries that import from typing
-        typing.override = _override  # type: ignore[attr-defined]
-except Exception:
-    # If typing_extensions not installed, do nothing; installing it will fix.
-    pass
+if sys.version_info < (3, 12) and not hasattr(typing, "override"):
+    def _override(method):
+        try:
+            method.__override__ = True
+        except (AttributeError, TypeError):
+            pass
+        return method
+
+    # Attach attribute for libraries that import from typing
+    typing.override = _override  # type: ignore[attr-defined]